@@ -3,7 +3,13 @@
 ### Imports
 ###############################################################################
 import os
+
+# Skip construct stack trace capture (export CDK_DISABLE_STACK_TRACE= to
+# keep it), set before aws_cdk starts the jsii runtime that reads it
+os.environ.setdefault("CDK_DISABLE_STACK_TRACE", "1")
+
 import aws_cdk as cdk
+from stacks.context import get_context
 from stacks.event_stack import EventStack
 from stacks.iam_stack import IamStack
 from stacks.lambda_stack import LambdaStack
@@ -22,7 +28,7 @@ app = cdk.App()
 ###############################################################################
 account = os.getenv("CDK_DEFAULT_ACCOUNT")
 region = os.getenv("CDK_DEFAULT_REGION")
-stack_vars = app.node.try_get_context("stacks")
+stack_vars = get_context(app, "stacks")
 
 ###############################################################################
 ### Stacks
@@ -33,7 +39,7 @@ main_stack = MainStack(
     env=cdk.Environment(account=account, region=region),
 )
 
-# Nested Stacks
+# Stack Constructs
 storage_stack = StorageStack(
     main_stack,
     stack_vars.get("storage_stack_name", "StorageStack"),
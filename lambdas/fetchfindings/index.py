@@ -2,176 +2,404 @@
 ### Imports
 ###############################################################################
 import boto3
-import json
+import csv
 import logging
+import os
+import re
+from botocore.config import Config
 from datetime import datetime
+from functools import lru_cache
+from io import BytesIO, TextIOWrapper
+from operator import itemgetter
 
 ###############################################################################
 ### Boto Clients
 ###############################################################################
-securityhub = boto3.client("securityhub")
-s3 = boto3.client("s3")
+# Adaptive retries absorb GetFindings throttling while paging
+config = Config(
+    max_pool_connections=50,
+    retries={"mode": "adaptive", "total_max_attempts": 10},
+    tcp_keepalive=True,
+)
+securityhub = boto3.client("securityhub", config=config)
+s3 = boto3.client("s3", config=config)
 
 ###############################################################################
 ### Logger Instance
 ###############################################################################
+# LOG_LEVEL=DEBUG also logs each fetched page, unknown names mean INFO
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+log_level = getattr(logging, os.environ.get("LOG_LEVEL", "INFO").upper(), None)
+logger.setLevel(log_level if isinstance(log_level, int) else logging.INFO)
+
+###############################################################################
+### Constants
+###############################################################################
+# Stop paginating and return the NextToken once less time than this remains
+REMAINING_TIME_THRESHOLD_MS = 60 * 1000
+
+# Size of each part when streaming findings to S3 (S3 minimum is 5 MiB)
+MULTIPART_CHUNK_SIZE = 5 * 1024 * 1024
+
+# Columns of the CSV report, in order
+CSV_HEADERS = (
+    "awsAccountId",
+    "awsAccountName",
+    "complianceStatus",
+    "controlId",
+    "description",
+    "findingId",
+    "firstSeen",
+    "lastSeen",
+    "region",
+    "remediationText",
+    "remediationUrl",
+    "resourceArn",
+    "severity",
+    "title",
+    "workflowStatus",
+    "securityStandards",
+)
+
+# Shared read-only defaults for missing finding fields
+EMPTY = {}
+NO_RESOURCES = (EMPTY,)
+
+# Security standards recognised in the findingId
+KNOWN_STANDARDS = (
+    "aws-foundational-security-best-practices",
+    "aws-resource-tagging-standard",
+    "cis-aws-foundations-benchmark",
+    "nist-800-53",
+    "pci-dss",
+)
+KNOWN_STANDARDS_PATTERN = re.compile("|".join(map(re.escape, KNOWN_STANDARDS)))
 
 
 ###############################################################################
 ### Functions
 ###############################################################################
+@lru_cache(maxsize=8192)
 def extract_security_standards_from_finding_id(finding_id):
     """
     Extracts security standards from the findingId field.
 
     :param finding_id: The findingId string from which to extract the security standards.
-    :return: A list of security standards found in the findingId.
+    :return: A tuple of security standards found in the findingId.
     """
-    known_standards = [
-        "aws-foundational-security-best-practices",
-        "aws-resource-tagging-standard",
-        "cis-aws-foundations-benchmark",
-        "nist-800-53",
-        "pci-dss",
-    ]
-    extracted_standards = [
-        standard for standard in known_standards if standard in finding_id
-    ]
-    return extracted_standards
+    return tuple(dict.fromkeys(KNOWN_STANDARDS_PATTERN.findall(finding_id)))
+
+
+def flatten_finding(item):
+    """
+    Flattens a Security Hub finding into a report row.
+
+    :param item: Finding as returned by Security Hub.
+    :return: Dictionary of report columns for the finding.
+    """
+    finding_id = item.get("Id", "")
+    recommendation = item.get("Remediation", EMPTY).get(
+        "Recommendation", EMPTY
+    )
+
+    return {
+        "awsAccountId": item.get("AwsAccountId", ""),
+        "awsAccountName": item.get("AwsAccountName", ""),
+        "complianceStatus": item.get("Compliance", EMPTY).get("Status", ""),
+        "controlId": item.get("ProductFields", EMPTY).get("ControlId", ""),
+        "description": item.get("Description", ""),
+        "findingId": finding_id,
+        "firstSeen": item.get("FirstObservedAt", ""),
+        "lastSeen": item.get("LastObservedAt", ""),
+        "region": item.get("Region", ""),
+        "remediationText": recommendation.get("Text", ""),
+        "remediationUrl": recommendation.get("Url", ""),
+        "resourceArn": (item.get("Resources") or NO_RESOURCES)[0].get(
+            "Id", ""
+        ),
+        "severity": item.get("Severity", EMPTY).get("Label", ""),
+        "title": item.get("Title", ""),
+        "workflowStatus": item.get("Workflow", EMPTY).get("Status", ""),
+        # The trailing finding UUID is unique per finding, so look the
+        # standards up by the shared control prefix to hit the cache
+        "securityStandards": ", ".join(
+            extract_security_standards_from_finding_id(
+                finding_id.partition("/finding/")[0]
+            )
+        ),
+    }
 
 
 def filter_data(
     input_list,
     compliance_status_filter=None,
-    security_standard_filter=None,
     severity_filter=None,
     workflow_status_filter=None,
 ):
     """
-    Filters the input list based on severity, compliance status, workflow status, and security standard, if provided,
-    and flattens the structure by adding a 'workflowStatus' field. Also creates a 'securityStandards' field by examining the findingId.
+    Filters the input list based on severity, compliance status and workflow status, if provided,
+    and flattens the structure by adding a 'workflowStatus' field. Also creates a comma separated 'securityStandards' field by examining the findingId.
 
-    :param input_list: List of findings to filter.
+    :param input_list: Iterable of findings to filter.
     :param complianceStatus_filter: List of compliance statuses to include in the output. If None, include all.
-    :param security_standard_filter: List of security standards to include in the output. If None, include all.
     :param severity_filter: List of severities to include in the output. If None, include all.
     :param workflow_status_filter: List of workflow statuses to include in the output. If None, include all.
-    :return: Filtered and flattened list of findings.
+    :return: Generator of filtered and flattened findings.
     """
-    logger.info("Filtering findings data")
-    filtered_list = [
-        {
-            "awsAccountId": item.get("AwsAccountId", ""),
-            "awsAccountName": item.get("AwsAccountName", ""),
-            "complianceStatus": item.get("Compliance", {}).get("Status", ""),
-            "controlId": item.get("ProductFields", {}).get("ControlId", ""),
-            "description": item.get("Description", ""),
-            "findingId": item.get("Id", ""),
-            "firstSeen": item.get("FirstObservedAt", ""),
-            "lastSeen": item.get("LastObservedAt", ""),
-            "region": item.get("Region", ""),
-            "remediationText": item.get("Remediation", {})
-            .get("Recommendation", {})
-            .get("Text", ""),
-            "remediationUrl": item.get("Remediation", {})
-            .get("Recommendation", {})
-            .get("Url", ""),
-            "resourceArn": item.get("Resources", [{}])[0].get("Id", ""),
-            "severity": item.get("Severity", {}).get("Label", ""),
-            "title": item.get("Title", ""),
-            "workflowStatus": item.get("Workflow", {}).get("Status", ""),
-            "securityStandards": extract_security_standards_from_finding_id(
-                item.get("Id", "")
-            ),
-        }
-        for item in input_list
+    # Nothing to filter on, only flatten the findings
+    if (
+        compliance_status_filter is None
+        and severity_filter is None
+        and workflow_status_filter is None
+    ):
+        yield from map(flatten_finding, input_list)
+        return
+
+    # Convert the filters to sets once for O(1) membership tests
+    if compliance_status_filter is not None:
+        compliance_status_filter = frozenset(compliance_status_filter)
+    if severity_filter is not None:
+        severity_filter = frozenset(severity_filter)
+    if workflow_status_filter is not None:
+        workflow_status_filter = frozenset(workflow_status_filter)
+
+    for item in input_list:
+        # Filter on the flattened row so each nested field is looked up once
+        row = flatten_finding(item)
+
         if (
-            severity_filter is None
-            or item.get("Severity", {}).get("Label", "") in severity_filter
-        )
-        and (
-            compliance_status_filter is None
-            or item.get("Compliance", {}).get("Status", "")
-            in compliance_status_filter
-        )
-        and (
-            workflow_status_filter is None
-            or item.get("Workflow", {}).get("Status", "")
-            in workflow_status_filter
-        )
-        and (
-            security_standard_filter is None
-            or any(
-                standard
-                in extract_security_standards_from_finding_id(
-                    item.get("Id", "")
-                )
-                for standard in security_standard_filter
+            severity_filter is not None
+            and row["severity"] not in severity_filter
+        ):
+            continue
+
+        if (
+            compliance_status_filter is not None
+            and row["complianceStatus"] not in compliance_status_filter
+        ):
+            continue
+
+        if (
+            workflow_status_filter is not None
+            and row["workflowStatus"] not in workflow_status_filter
+        ):
+            continue
+
+        yield row
+
+
+def build_filters(
+    compliance_status_filter=None,
+    security_standard_filter=None,
+    severity_filter=None,
+    workflow_status_filter=None,
+):
+    """
+    Builds the Security Hub findings filters so filtering happens server-side.
+
+    :param compliance_status_filter: List of compliance statuses to include. If None, include all.
+    :param security_standard_filter: List of security standards to include. If None, include all.
+    :param severity_filter: List of severities to include. If None, include all.
+    :param workflow_status_filter: List of workflow statuses to include. If None, include all.
+    :return: AwsSecurityFindingFilters dictionary for the get_findings API.
+    """
+    filters = {}
+    for field, values in (
+        ("ComplianceStatus", compliance_status_filter),
+        ("SeverityLabel", severity_filter),
+        ("WorkflowStatus", workflow_status_filter),
+    ):
+        if values:
+            filters[field] = [
+                {"Value": value, "Comparison": "EQUALS"} for value in values
+            ]
+
+    # Standard control findings have a GeneratorId starting with the
+    # standard, or with its ruleset ARN for CIS v1.2.0
+    if security_standard_filter:
+        filters["GeneratorId"] = [
+            {"Value": value, "Comparison": "PREFIX"}
+            for standard in security_standard_filter
+            for value in (
+                f"{standard}/",
+                f"arn:aws:securityhub:::ruleset/{standard}/",
             )
-        )
-    ]
-    logger.info(f"Filtered data contains {len(filtered_list)} findings")
-    return filtered_list
+        ]
+    return filters
 
 
-def get_sh_findings(params):
+def get_sh_findings(filters, max_results, pagination, context):
+    """
+    Yields findings from Security Hub page by page until the last page or the time budget is reached.
+
+    :param filters: AwsSecurityFindingFilters dictionary for the get_findings API.
+    :param max_results: Number of findings to request per page.
+    :param pagination: Dictionary holding the NextToken to resume from, updated after each page.
+    :param context: Lambda context used to check the remaining time.
+    :return: Generator of findings.
+    """
+    # Resume with the service NextToken handed back by the previous
+    # invocation, rather than a paginator resume token
+    request = {"Filters": filters, "MaxResults": max_results}
+    next_token = pagination.get("NextToken")
+
     try:
         logger.info("Fetching findings from Security Hub...")
-        # Fetch findings from Security Hub
-        response = securityhub.get_findings(**params)
-        findings = response["Findings"]
-        logger.info(f"Found {len(findings)} findings")
-        if "NextToken" in response:
-            next_token = response["NextToken"]
-            logger.info(f"New NextToken: {next_token}")
-        else:
-            logger.info("No NextToken found")
-            next_token = None
-        return findings, next_token
+        while True:
+            if next_token:
+                request["NextToken"] = next_token
+            page = securityhub.get_findings(**request)
+            logger.debug("Found %d findings", len(page["Findings"]))
+            yield from page["Findings"]
+
+            next_token = page.get("NextToken")
+            pagination["NextToken"] = next_token
+            if not next_token:
+                break
+
+            # Hand the remaining pages back to the Step Function when the
+            # invocation is running out of time
+            if (
+                context.get_remaining_time_in_millis()
+                < REMAINING_TIME_THRESHOLD_MS
+            ):
+                logger.info("Time budget reached, NextToken: %s", next_token)
+                break
 
     except Exception as e:
-        logger.error(f"Error fetching findings: {str(e)}")
+        logger.error("Error fetching findings: %s", e)
         raise
 
 
-def save_findings(bucket_name, findings, request_id):
-    # Get current date and format it
-    current_date = datetime.now().strftime("%Y-%m-%d")
+def save_findings(bucket_name, findings, request_id, current_date):
+    """
+    Streams findings to S3 as CSV rows, switching to a multipart upload once the data outgrows one part.
+
+    :param bucket_name: Name of the S3 bucket to save the findings to.
+    :param findings: Iterable of findings to save.
+    :param request_id: Lambda request ID used to name the part file.
+    :param current_date: Date (YYYY-MM-DD) the findings are saved under.
+    :return: Tuple of the bucket name and the prefix the findings were saved under.
+    """
     prefix = f"findings/{current_date}"
-    file_name = f"part-{request_id}.json"
+    file_name = f"part-{request_id}.csv"
+    key = prefix + "/" + file_name
 
-    try:
-        logger.info(f"Saving findings to S3 bucket: {bucket_name}")
-        # Upload findings to S3 (optional)
-        s3.put_object(
-            Bucket=bucket_name,
-            Key=prefix + "/" + file_name,
-            Body=json.dumps(findings),
+    # Encode rows to UTF-8 as they are written, parts are sent as-is
+    csv_buffer = BytesIO()
+    writer = csv.writer(
+        TextIOWrapper(
+            csv_buffer, encoding="utf-8", newline="", write_through=True
         )
-        logger.info(f"Saved findings to:")
-        logger.info(f"S3 bucket: {bucket_name}")
-        logger.info(f"S3 prefix: {prefix}")
-        logger.info(f"File: {file_name}")
+    )
+
+    # Write the headers, generatecsv keeps them from the first part only
+    writer.writerow(CSV_HEADERS)
+
+    # Resolve the header to column mapping once for every row
+    get_row = itemgetter(*CSV_HEADERS)
+
+    count = 0
+    parts = []
+    upload_id = None
+
+    try:
+        logger.info("Saving findings to S3 bucket: %s", bucket_name)
+        for finding in findings:
+            writer.writerow(get_row(finding))
+            count += 1
+
+            # Upload a part once the buffer holds enough data
+            if csv_buffer.tell() >= MULTIPART_CHUNK_SIZE:
+                if upload_id is None:
+                    upload_id = s3.create_multipart_upload(
+                        Bucket=bucket_name, Key=key
+                    )["UploadId"]
+                parts.append(
+                    upload_part(
+                        bucket_name,
+                        key,
+                        upload_id,
+                        parts,
+                        csv_buffer.getvalue(),
+                    )
+                )
+                csv_buffer.seek(0)
+                csv_buffer.truncate()
+
+        if upload_id is None:
+            # Everything fits in a single part, skip the multipart upload
+            s3.put_object(
+                Bucket=bucket_name,
+                Key=key,
+                Body=csv_buffer.getvalue(),
+            )
+        else:
+            if csv_buffer.tell():
+                parts.append(
+                    upload_part(
+                        bucket_name,
+                        key,
+                        upload_id,
+                        parts,
+                        csv_buffer.getvalue(),
+                    )
+                )
+            s3.complete_multipart_upload(
+                Bucket=bucket_name,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+
+        logger.info("Saved %d findings to:", count)
+        logger.info("S3 bucket: %s", bucket_name)
+        logger.info("S3 prefix: %s", prefix)
+        logger.info("File: %s", file_name)
 
         return bucket_name, prefix
     except Exception as e:
-        logger.error(f"Error saving findings to S3: {str(e)}")
+        logger.error("Error saving findings to S3: %s", e)
+        if upload_id is not None:
+            s3.abort_multipart_upload(
+                Bucket=bucket_name, Key=key, UploadId=upload_id
+            )
         raise
 
 
+def upload_part(bucket_name, key, upload_id, parts, body):
+    """Upload the body as the next part of a multipart upload."""
+    part_number = len(parts) + 1
+    response = s3.upload_part(
+        Bucket=bucket_name,
+        Key=key,
+        UploadId=upload_id,
+        PartNumber=part_number,
+        Body=body,
+    )
+    return {"ETag": response["ETag"], "PartNumber": part_number}
+
+
 ###############################################################################
 ### Lambda Handler
 ###############################################################################
 def lambda_handler(event, context):
     # Log Event and Context
-    logger.info(f"event: {event}")
-    logger.info(f"context: {context.__dict__}")
+    logger.debug("event: %s", event)
+    logger.debug("context: %s", context.__dict__)
 
     # Get Context Request ID
     request_id = context.aws_request_id
 
+    # Use the execution start date so every page shares the same prefix
+    execution_start_time = event.get("ExecutionStartTime")
+    current_date = (
+        execution_start_time[:10]
+        if execution_start_time
+        else datetime.now().strftime("%Y-%m-%d")
+    )
+    logger.info("Date: %s", current_date)
+
     # Get Optional Filter Criteria
     compliance_status_filter = event.get("ComplianceStatusFilter", None)
     security_standard_filter = event.get("SecurityStandardFilter", None)
@@ -179,10 +407,10 @@ def lambda_handler(event, context):
     workflow_status_filter = event.get("WorkflowStatusFilter", None)
 
     # Log Optional Filter Criteria
-    logger.info(f"ComplianceStatusFilter: {compliance_status_filter}")
-    logger.info(f"SecurityStandardFilter: {security_standard_filter}")
-    logger.info(f"SeverityFilter: {severity_filter}")
-    logger.info(f"WorkflowStatusFilter: {workflow_status_filter}")
+    logger.info("ComplianceStatusFilter: %s", compliance_status_filter)
+    logger.info("SecurityStandardFilter: %s", security_standard_filter)
+    logger.info("SeverityFilter: %s", severity_filter)
+    logger.info("WorkflowStatusFilter: %s", workflow_status_filter)
 
     # Get Bucket Name
     bucket_name = event.get("BucketName", None)
@@ -193,35 +421,43 @@ def lambda_handler(event, context):
 
     # Get NextToken
     next_token = event.get("NextToken", None)
-    logger.info(f"NextToken: {next_token}")
+    logger.info("NextToken: %s", next_token)
 
-    # Prepare Parameters
-    params = {
-        "MaxResults": event.get("MaxResults", 100),
-    }
+    # Prepare Server-Side Filters
+    filters = build_filters(
+        compliance_status_filter,
+        security_standard_filter,
+        severity_filter,
+        workflow_status_filter,
+    )
+    logger.debug("Fetching findings with filters: %s", filters)
 
     # Get Security Hub Findings
-    if next_token:
-        logger.info(f"Fetching findings with NextToken: {next_token}")
-        params["NextToken"] = next_token
-        logger.info(f"Fetching findings with params: {params}")
-        findings, next_token = get_sh_findings(params)
+    pagination = {"NextToken": next_token}
+    if security_standard_filter == []:
+        # An empty standard list matches nothing, like the other filters,
+        # so skip the query and save a header-only part
+        logger.info("SecurityStandardFilter is empty, no findings to fetch")
+        pagination["NextToken"] = None
+        findings = ()
     else:
-        logger.info("Fetching findings without NextToken")
-        logger.info(f"Fetching findings with params: {params}")
-        findings, next_token = get_sh_findings(params)
+        findings = get_sh_findings(
+            filters, event.get("MaxResults", 100), pagination, context
+        )
 
     # Filter Security Hub Findings
     filtered_data = filter_data(
         findings,
         compliance_status_filter,
-        security_standard_filter,
         severity_filter,
         workflow_status_filter,
     )
 
     # Save Security Hub Findings to S3
-    bucket_name, prefix = save_findings(bucket_name, filtered_data, request_id)
+    bucket_name, prefix = save_findings(
+        bucket_name, filtered_data, request_id, current_date
+    )
+    next_token = pagination["NextToken"]
 
     # Prepare Response Payload
     if next_token:
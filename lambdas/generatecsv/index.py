@@ -2,113 +2,225 @@
 ### Imports
 ###############################################################################
 import boto3
-import csv
-import json
 import logging
+import os
+from botocore.config import Config
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from io import StringIO
 
 ###############################################################################
 ### Boto Clients
 ###############################################################################
-s3 = boto3.client("s3")
+# Pool sized for the parallel part downloads, with adaptive S3 retries
+config = Config(
+    max_pool_connections=50,
+    retries={"mode": "adaptive", "total_max_attempts": 10},
+    tcp_keepalive=True,
+)
+s3 = boto3.client("s3", config=config)
 
 
 ###############################################################################
 ### Logger Instance
 ###############################################################################
+# Verbosity from LOG_LEVEL (any case), INFO when unset or unrecognised
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-
+log_level = getattr(logging, os.environ.get("LOG_LEVEL", "INFO").upper(), None)
+logger.setLevel(log_level if isinstance(log_level, int) else logging.INFO)
 
 ###############################################################################
-### Functions
+### Constants
 ###############################################################################
-def combine_json_data(bucket_name, prefix):
-    """Combine JSON data from multiple files under a specific prefix."""
-    logger.info(f"Combining JSON data from S3: {bucket_name}/{prefix}")
+# Number of small CSV part files downloaded from S3 in parallel
+MAX_DOWNLOAD_WORKERS = 30
 
-    json_data = []
+# Part files up to this size are read ahead in full, larger ones are streamed
+MAX_PREFETCH_SIZE = 1024 * 1024
 
-    try:
-        # List all JSON files under the prefix
-        json_files = list_s3_objects(bucket_name, prefix)
+# Size of the chunks read from a streamed part file
+READ_CHUNK_SIZE = 64 * 1024
 
-        for json_file in json_files:
-            # Read and append JSON data from each file
-            data = read_json_from_s3(bucket_name, json_file)
-            json_data.extend(data)
+# Size of each part when streaming the CSV to S3 (S3 minimum is 5 MiB)
+MULTIPART_CHUNK_SIZE = 5 * 1024 * 1024
 
-        return json_data
+
+###############################################################################
+### Functions
+###############################################################################
+def combine_csv_data(bucket_name, prefix):
+    """Yield CSV data from multiple part files under a specific prefix."""
+    logger.info("Combining CSV data from S3: %s/%s", bucket_name, prefix)
+
+    try:
+        # List all CSV part files under the prefix
+        csv_files = list_s3_objects(bucket_name, prefix, suffix=".csv")
+
+        # Read small files ahead in parallel and hand each one on as soon as
+        # it is next in order. Only queue another download once the oldest
+        # one has been consumed, so at most MAX_DOWNLOAD_WORKERS small files
+        # are held in memory. Larger files are streamed in chunks when their
+        # turn comes, so no whole large file is ever held in memory.
+        with ThreadPoolExecutor(MAX_DOWNLOAD_WORKERS) as executor:
+            pending = deque()
+            for index, (key, size) in enumerate(csv_files):
+                # Every part starts with the headers, keep the first only
+                if size <= MAX_PREFETCH_SIZE:
+                    pending.append(
+                        executor.submit(
+                            read_csv_from_s3, bucket_name, key, index > 0
+                        )
+                    )
+                else:
+                    pending.append((key, index > 0))
+                if len(pending) >= MAX_DOWNLOAD_WORKERS:
+                    yield from next_csv_data(bucket_name, pending.popleft())
+
+            while pending:
+                yield from next_csv_data(bucket_name, pending.popleft())
     except Exception as e:
-        logger.error(f"Error combining JSON data: {str(e)}")
+        logger.error("Error combining CSV data: %s", e)
         raise
 
 
-def list_s3_objects(bucket_name, prefix):
-    """List all objects in an S3 bucket under a specific prefix."""
+def next_csv_data(bucket_name, item):
+    """Yield the data of a read-ahead file, or stream a large file."""
+    if isinstance(item, tuple):
+        yield from stream_csv_from_s3(bucket_name, *item)
+    else:
+        yield item.result()
+
+
+def list_s3_objects(bucket_name, prefix, suffix=""):
+    """List the keys and sizes of the objects under a prefix and suffix."""
     logger.info(
-        f"Listing S3 objects in bucket: {bucket_name}, prefix: {prefix}"
+        "Listing S3 objects in bucket: %s, prefix: %s", bucket_name, prefix
     )
     objects = []
 
     try:
-        response = s3.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
+        paginator = s3.get_paginator("list_objects_v2")
 
         # Iterate through the listed objects and append their keys to the list
-        while response.get("Contents"):
-            objects.extend([obj["Key"] for obj in response["Contents"]])
-
-            # If there are more objects, continue to the next batch
-            if response["IsTruncated"]:
-                response = s3.list_objects_v2(
-                    Bucket=bucket_name,
-                    Prefix=prefix,
-                    ContinuationToken=response["NextContinuationToken"],
-                )
-            else:
-                break
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            objects.extend(
+                [
+                    (obj["Key"], obj["Size"])
+                    for obj in page.get("Contents", [])
+                    if obj["Key"].endswith(suffix)
+                ]
+            )
 
         logger.info(
-            f"Found {len(objects)} objects in S3: {bucket_name}/{prefix}"
+            "Found %d objects in S3: %s/%s", len(objects), bucket_name, prefix
         )
 
         return objects
     except Exception as e:
-        logger.error(f"Error listing S3 objects: {str(e)}")
+        logger.error("Error listing S3 objects: %s", e)
         raise
 
 
-def read_json_from_s3(bucket_name, key):
-    """Read JSON data from an S3 object."""
+def read_csv_from_s3(bucket_name, key, skip_header=False):
+    """Read CSV data from an S3 object, optionally without its header row."""
     obj = s3.get_object(Bucket=bucket_name, Key=key)
-    return json.loads(obj["Body"].read().decode("utf-8"))
+    data = obj["Body"].read()
+    if skip_header:
+        data = data[data.find(b"\n") + 1 :]
+    return data
 
 
-def write_csv_to_s3(bucket_name, output_csv, data, headers):
-    """Write CSV data to an S3 object."""
-    logger.info(f"Writing CSV data to S3: {bucket_name}/{output_csv}")
+def stream_csv_from_s3(bucket_name, key, skip_header=False):
+    """Yield CSV data from an S3 object in chunks, optionally headerless."""
+    obj = s3.get_object(Bucket=bucket_name, Key=key)
+    for chunk in obj["Body"].iter_chunks(READ_CHUNK_SIZE):
+        if skip_header:
+            newline = chunk.find(b"\n")
+            if newline < 0:
+                continue
+            chunk = chunk[newline + 1 :]
+            skip_header = False
+        if chunk:
+            yield chunk
+
+
+def upload_part(bucket_name, key, upload_id, parts, body):
+    """Upload the body as the next part of a multipart upload."""
+    part_number = len(parts) + 1
+    response = s3.upload_part(
+        Bucket=bucket_name,
+        Key=key,
+        UploadId=upload_id,
+        PartNumber=part_number,
+        Body=body,
+    )
+    return {"ETag": response["ETag"], "PartNumber": part_number}
 
-    csv_buffer = StringIO()
-    writer = csv.DictWriter(csv_buffer, fieldnames=headers)
 
-    # Write the headers
-    writer.writeheader()
+def write_csv_to_s3(bucket_name, output_csv, data):
+    """Stream CSV data to an S3 object in multipart chunks."""
+    logger.info("Writing CSV data to S3: %s/%s", bucket_name, output_csv)
 
-    try:
-        # Write the data
-        for item in data:
-            item["securityStandards"] = ", ".join(item["securityStandards"])
-            writer.writerow(item)
-
-        # Upload the CSV to S3
-        s3.put_object(
-            Bucket=bucket_name, Key=output_csv, Body=csv_buffer.getvalue()
-        )
+    # Chunks of the next part, joined only when the part is uploaded
+    buffer = []
+    buffer_size = 0
+    parts = []
+    upload_id = None
 
-        logger.info(f"CSV data written to S3: {bucket_name}/{output_csv}")
+    try:
+        # Write the data as it is read from S3
+        for chunk in data:
+            buffer.append(chunk)
+            buffer_size += len(chunk)
+
+            # Upload a part once the buffer holds enough data
+            if buffer_size >= MULTIPART_CHUNK_SIZE:
+                if upload_id is None:
+                    upload_id = s3.create_multipart_upload(
+                        Bucket=bucket_name, Key=output_csv
+                    )["UploadId"]
+                parts.append(
+                    upload_part(
+                        bucket_name,
+                        output_csv,
+                        upload_id,
+                        parts,
+                        b"".join(buffer),
+                    )
+                )
+                buffer.clear()
+                buffer_size = 0
+
+        if upload_id is None:
+            # Everything fits in a single part, skip the multipart upload
+            s3.put_object(
+                Bucket=bucket_name, Key=output_csv, Body=b"".join(buffer)
+            )
+        else:
+            if buffer:
+                parts.append(
+                    upload_part(
+                        bucket_name,
+                        output_csv,
+                        upload_id,
+                        parts,
+                        b"".join(buffer),
+                    )
+                )
+            s3.complete_multipart_upload(
+                Bucket=bucket_name,
+                Key=output_csv,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+
+        logger.info("CSV data written to S3: %s/%s", bucket_name, output_csv)
     except Exception as e:
-        logger.error(f"Error writing CSV data to S3: {str(e)}")
+        logger.error("Error writing CSV data to S3: %s", e)
+        if upload_id is not None:
+            s3.abort_multipart_upload(
+                Bucket=bucket_name, Key=output_csv, UploadId=upload_id
+            )
         raise
 
 
@@ -117,19 +229,24 @@ def write_csv_to_s3(bucket_name, output_csv, data, headers):
 ###############################################################################
 def lambda_handler(event, context):
     # Log Event and Context
-    logger.info(f"event: {event}")
-    logger.info(f"context: {context.__dict__}")
-
-    # Get current date and format it
-    current_date = datetime.now().strftime("%Y-%m-%d")
+    logger.debug("event: %s", event)
+    logger.debug("context: %s", context.__dict__)
+
+    # Use the execution start date to match the fetched findings prefix
+    execution_start_time = event.get("ExecutionStartTime")
+    current_date = (
+        execution_start_time[:10]
+        if execution_start_time
+        else datetime.now().strftime("%Y-%m-%d")
+    )
 
     # Format Output Key
     output_csv = f"reports/findings_report-{current_date}.csv"
-    logger.info(f"Output CSV: {output_csv}")
+    logger.info("Output CSV: %s", output_csv)
 
     # Get the bucket name from the event payload
     bucket_name = event.get("BucketName")
-    logger.info(f"BucketName: {bucket_name}")
+    logger.info("BucketName: %s", bucket_name)
 
     if not bucket_name:
         logger.error("BucketName is required in the event payload.")
@@ -142,30 +259,8 @@ def lambda_handler(event, context):
         logger.error("Prefix is required in the event payload.")
         raise ValueError("Prefix is required in the event payload.")
 
-    # Define the CSV file headers
-    headers = [
-        "awsAccountId",
-        "awsAccountName",
-        "complianceStatus",
-        "controlId",
-        "description",
-        "findingId",
-        "firstSeen",
-        "lastSeen",
-        "region",
-        "remediationText",
-        "remediationUrl",
-        "resourceArn",
-        "severity",
-        "title",
-        "workflowStatus",
-        "securityStandards",
-    ]
-
-    # Combine the JSON data from the files in S3
-    combined_data = combine_json_data(bucket_name, input_prefix)
-
-    # Write the combined data to a CSV file in S3
-    write_csv_to_s3(bucket_name, output_csv, combined_data, headers)
+    # Combine the CSV part files in S3 into a single CSV file in S3
+    combined_data = combine_csv_data(bucket_name, input_prefix)
+    write_csv_to_s3(bucket_name, output_csv, combined_data)
 
     return output_csv
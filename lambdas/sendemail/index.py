@@ -2,35 +2,61 @@
 ### Imports
 ###############################################################################
 import boto3
-from botocore.exceptions import ClientError
-import csv
-import io
+from botocore.config import Config
 import json
 import logging
+import os
 from datetime import datetime
-from io import StringIO
+from email.message import EmailMessage
 
 ###############################################################################
 ### Boto Clients
 ###############################################################################
-s3 = boto3.client("s3")
-ses = boto3.client("ses")
+# Adaptive retries and kept-alive connections for the S3 and SES calls
+config = Config(
+    max_pool_connections=50,
+    retries={"mode": "adaptive", "total_max_attempts": 10},
+    tcp_keepalive=True,
+)
+# Presigned URLs are signed with SigV4, required in newer regions
+s3 = boto3.client("s3", config=config.merge(Config(signature_version="s3v4")))
+ses = boto3.client("ses", config=config)
 
 
 ###############################################################################
 ### Logger Instance
 ###############################################################################
+# Event payloads are only logged at DEBUG, a bad LOG_LEVEL falls to INFO
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+log_level = getattr(logging, os.environ.get("LOG_LEVEL", "INFO").upper(), None)
+logger.setLevel(log_level if isinstance(log_level, int) else logging.INFO)
+
+###############################################################################
+### Constants
+###############################################################################
+# SES rejects raw messages above 10 MB, base64 encoding included
+MAX_MESSAGE_SIZE = 10 * 1000 * 1000
+
+# Room left in the message for the headers and the body text
+MESSAGE_HEADROOM = 64 * 1024
+
+# Lifetime of the report download link, in seconds
+PRESIGNED_URL_EXPIRATION = 24 * 60 * 60
+
+# How the CSV file reaches the recipients
+MODE_ATTACHMENT = "attachment"
+MODE_PRESIGNED_URL = "presigned_url"
 
 
 ###############################################################################
 ### Functions
 ###############################################################################
-def generate_presigned_url(bucket_name, key, expiration=84000):
+def generate_presigned_url(
+    bucket_name, key, expiration=PRESIGNED_URL_EXPIRATION
+):
     """Generate a presigned URL for the S3 object."""
     logger.info(
-        f"Generating presigned URL for S3 object: s3://{bucket_name}/{key}"
+        "Generating presigned URL for S3 object: s3://%s/%s", bucket_name, key
     )
 
     try:
@@ -41,51 +67,29 @@ def generate_presigned_url(bucket_name, key, expiration=84000):
             ExpiresIn=expiration,
         )
 
-        logger.info(f"Presigned URL: {url}")
+        logger.debug("Presigned URL: %s", url)
 
         return url
     except Exception as e:
-        logger.error(f"Error generating presigned URL: {e}")
+        logger.error("Error generating presigned URL: %s", e)
         return None
 
 
-def get_csv_size_s3(bucket_name, key):
-    """Get the size of a CSV file in S3."""
-    logger.info(f"Getting CSV file size from S3: s3://{bucket_name}/{key}")
-
-    # Get the CSV file from S3
-    obj = s3.get_object(Bucket=bucket_name, Key=key)
-
-    # Get the content length
-    file_size = obj["ContentLength"]
-
-    # Convert size to MB for better readability
-    file_size_mb = file_size / (1024 * 1024)
-
-    logger.info(f"CSV file size: {file_size_mb} MB")
-
-    if file_size_mb > 10:
-        logger.info("File size exceeds 10 MB.")
-        return True
-    else:
-        logger.info("File size is less than 10 MB.")
-        return False
+def encoded_attachment_size(size):
+    """Size of a base64 MIME attachment, CRLF every 76 characters."""
+    encoded = (size + 2) // 3 * 4
+    return encoded + (encoded + 75) // 76 * 2
 
 
 def read_csv_from_s3(bucket_name, key):
     """Read a CSV file from S3 and return its content."""
-    logger.info(f"Reading CSV file from S3: s3://{bucket_name}/{key}")
+    logger.info("Reading CSV file from S3: s3://%s/%s", bucket_name, key)
 
     # Get the CSV file from S3
     obj = s3.get_object(Bucket=bucket_name, Key=key)
 
     # Read the content of the file
-    csv_content = obj["Body"].read().decode("utf-8")
-
-    # Use StringIO to simulate a file object from the CSV content
-    csv_file = StringIO(csv_content)
-
-    return csv_file.getvalue()
+    return obj["Body"].read()
 
 
 def send_email(
@@ -100,43 +104,36 @@ def send_email(
     # filename=None,
     key=None,
     presigned_url=None,
+    date_str=None,
+    mode=MODE_ATTACHMENT,
 ):
     logger.info("Sending email...")
 
-    # Get the current date
-    current_date = datetime.now()
-
-    # Format the date as MMDDYYYY
-    date_str = current_date.strftime("%m%d%Y")
-
-    if not presigned_url:
+    if mode == MODE_ATTACHMENT:
         logger.info("Sending email with attachment")
 
         # Attachment Filename
         filename = f"securityhub-findings-{date_str}.csv"
 
+        # Build the MIME message with the CSV as a base64 attachment
+        msg = EmailMessage()
+        msg["From"] = sender_email
+        msg["To"] = ", ".join(recipient_emails)
+        msg["Subject"] = subject
+        msg.set_content(body_text or "", charset=charset)
+        msg.add_attachment(
+            csv_content,
+            maintype="text",
+            subtype="csv",
+            filename=filename,
+        )
+
         # Send Email
         try:
             response = ses.send_raw_email(
                 Source=sender_email,
                 Destinations=recipient_emails,
-                RawMessage={
-                    "Data": (
-                        f"From: {sender_email}\n"
-                        f"To: {', '.join(recipient_emails)}\n"
-                        f"Subject: {subject}\n"
-                        "MIME-Version: 1.0\n"
-                        'Content-Type: multipart/mixed; boundary="NextPart"\n\n'
-                        "--NextPart\n"
-                        f"Content-Type: text/plain; charset={charset}\n\n"
-                        f"{body_text}\n\n"
-                        "--NextPart\n"
-                        "Content-Type: text/csv;\n"
-                        f'Content-Disposition: attachment; filename="{filename}"\n\n'
-                        f"{csv_content}\n\n"
-                        "--NextPart--"
-                    )
-                },
+                RawMessage={"Data": msg.as_bytes()},
             )
 
             logger.info("Email sent! Message ID:"),
@@ -146,10 +143,10 @@ def send_email(
 
         except Exception as e:
             logger.error(
-                f"Error sending email: {e.response['Error']['Message']}"
+                "Error sending email: %s", e.response["Error"]["Message"]
             )
             return False
-    elif presigned_url:
+    elif mode == MODE_PRESIGNED_URL:
         logger.info("Sending email with presigned URL")
 
         # Form Body Text
@@ -164,7 +161,7 @@ def send_email(
         Bucket: {bucket_name}
         Key: {key}
 
-        The link will expire in one hour. Please download the file before the expiration time.
+        The link will expire in {PRESIGNED_URL_EXPIRATION // 3600} hours. Please download the file before the expiration time.
 
         Best regards,
         Your Lambda Function
@@ -184,9 +181,14 @@ def send_email(
                 },
             )
 
+            logger.info("Email sent! Message ID: %s", response["MessageId"])
+
+            return response
         except Exception as e:
-            logger.error(f"Error sending email: {e}")
+            logger.error("Error sending email: %s", e)
             return False
+    else:
+        raise ValueError(f"Unknown email mode: {mode}")
 
 
 ###############################################################################
@@ -194,8 +196,17 @@ def send_email(
 ###############################################################################
 def lambda_handler(event, context):
     # Log Event and Context
-    logger.info(f"event: {event}")
-    logger.info(f"context: {context.__dict__}")
+    logger.debug("event: %s", event)
+    logger.debug("context: %s", context.__dict__)
+
+    # Use the execution start date, formatted as MMDDYYYY
+    execution_start_time = event.get("ExecutionStartTime")
+    current_date = (
+        datetime.strptime(execution_start_time[:10], "%Y-%m-%d")
+        if execution_start_time
+        else datetime.now()
+    )
+    date_str = current_date.strftime("%m%d%Y")
 
     # Get Email Body Text
     body_text = event.get("BodyText")
@@ -205,7 +216,7 @@ def lambda_handler(event, context):
 
     # Get Bucket Name
     bucket_name = event.get("BucketName", None)
-    logger.info(f"BucketName: {bucket_name}")
+    logger.info("BucketName: %s", bucket_name)
 
     if not bucket_name:
         logger.error("BucketName is required in the event payload.")
@@ -213,7 +224,7 @@ def lambda_handler(event, context):
 
     # Get Output CSV
     output_csv = event.get("OutputCsv", None)
-    logger.info(f"OutputCsv: {output_csv}")
+    logger.info("OutputCsv: %s", output_csv)
 
     if not output_csv:
         logger.error("OutputCsv is required in the event payload.")
@@ -221,7 +232,7 @@ def lambda_handler(event, context):
 
     # Get Sender Email
     sender_email = event.get("SenderEmail", None)
-    logger.info(f"SenderEmail: {sender_email}")
+    logger.info("SenderEmail: %s", sender_email)
 
     if not sender_email:
         logger.error("SenderEmail is required in the event payload.")
@@ -229,18 +240,27 @@ def lambda_handler(event, context):
 
     # Get Recipient Emails
     recipient_emails = event.get("RecipientEmails", None)
-    logger.info(f"RecipientEmails: {recipient_emails}")
+    logger.info("RecipientEmails: %s", recipient_emails)
 
     if not recipient_emails:
         logger.error("RecipientEmails is required in the event payload.")
         raise ValueError("RecipientEmails is required in the event payload.")
 
-    csv_data = read_csv_from_s3(bucket_name, output_csv)
+    # Get the file size without downloading the CSV file
+    file_size = s3.head_object(Bucket=bucket_name, Key=output_csv)[
+        "ContentLength"
+    ]
+    file_size_mb = file_size / (1024 * 1024)
+    logger.info("CSV file size: %s MB", file_size_mb)
+
+    # Attach the CSV file only if the encoded message fits within SES limits
+    message_size = encoded_attachment_size(file_size) + MESSAGE_HEADROOM
+    if message_size <= MAX_MESSAGE_SIZE:
+        logger.info("Encoded message size: %s bytes.", message_size)
 
-    # Check File Size
-    file_size = get_csv_size_s3(bucket_name, output_csv)
+        # Only download the CSV file when it is attached
+        csv_data = read_csv_from_s3(bucket_name, output_csv)
 
-    if not file_size:
         # Send Email with Attachment
         response = send_email(
             body_text=body_text,
@@ -248,26 +268,38 @@ def lambda_handler(event, context):
             recipient_emails=recipient_emails,
             sender_email=sender_email,
             subject=subject,
+            date_str=date_str,
+            mode=MODE_ATTACHMENT,
         )
     else:
-        expiration = 84600
-        presigned_url = generate_presigned_url(
-            bucket_name=bucket_name,
-            key=output_csv,
-            expiration=expiration,
+        logger.info(
+            "Encoded message size %s bytes exceeds %s bytes.",
+            message_size,
+            MAX_MESSAGE_SIZE,
         )
-        # Send Email with Presigned URL
-        response = send_email(
-            body_text=body_text,
+
+        presigned_url = generate_presigned_url(
             bucket_name=bucket_name,
-            file_size_mb=file_size,
             key=output_csv,
-            presigned_url=presigned_url,
-            recipient_emails=recipient_emails,
-            sender_email=sender_email,
-            subject=subject,
         )
 
+        # Without a link there is nothing to send, report the failure
+        if presigned_url:
+            # Send Email with Presigned URL
+            response = send_email(
+                body_text=body_text,
+                bucket_name=bucket_name,
+                file_size_mb=file_size_mb,
+                key=output_csv,
+                presigned_url=presigned_url,
+                recipient_emails=recipient_emails,
+                sender_email=sender_email,
+                subject=subject,
+                mode=MODE_PRESIGNED_URL,
+            )
+        else:
+            response = False
+
     if response:
         return {
             "statusCode": 200,
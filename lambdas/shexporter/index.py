@@ -2,51 +2,127 @@
 ### Standard Imports
 ###############################################################################
 import csv
+import gzip
 import json
 import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from io import StringIO
+from email.message import EmailMessage
+from functools import lru_cache
+from io import BytesIO, TextIOWrapper
+from queue import Full, Queue
+from tempfile import SpooledTemporaryFile
+from threading import Event
 
 ###############################################################################
 ### Boto Imports
 ###############################################################################
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 ###############################################################################
 ### Boto Clients
 ###############################################################################
-ses = boto3.client("ses")
-sh = boto3.client("securityhub")
+# Pool sized for the severity partitions paging Security Hub in parallel
+config = Config(
+    max_pool_connections=50,
+    retries={"mode": "adaptive", "total_max_attempts": 10},
+    tcp_keepalive=True,
+)
+# Presigned URLs are signed with SigV4, required in newer regions
+s3 = boto3.client("s3", config=config.merge(Config(signature_version="s3v4")))
+ses = boto3.client("ses", config=config)
+sh = boto3.client("securityhub", config=config)
 
 ###############################################################################
 ### Logger Instance
 ###############################################################################
+# Defaults to INFO, also when LOG_LEVEL is not a logging level name
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+log_level = getattr(logging, os.environ.get("LOG_LEVEL", "INFO").upper(), None)
+logger.setLevel(log_level if isinstance(log_level, int) else logging.INFO)
+
+###############################################################################
+### Constants
+###############################################################################
+# Columns of the CSV report, in order
+CSV_HEADERS = (
+    "awsAccountId",
+    "awsAccountName",
+    "complianceStatus",
+    "controlId",
+    "description",
+    "findingId",
+    "firstSeen",
+    "lastSeen",
+    "region",
+    "remediationText",
+    "remediationUrl",
+    "resourceArn",
+    "securityStandards",
+    "severity",
+    "title",
+    "workflowStatus",
+)
+
+# Largest page size supported by the get_findings API
+PAGE_SIZE = 100
+
+# Severity labels used to split the findings into parallel queries
+SEVERITY_LABELS = (
+    "INFORMATIONAL",
+    "LOW",
+    "MEDIUM",
+    "HIGH",
+    "CRITICAL",
+)
+
+# Seconds a partition waits on a full page queue before checking for a stop
+QUEUE_PUT_TIMEOUT = 0.5
+
+# Reports held in memory up to this size before spilling to /tmp
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+# Multipart settings for uploading the report to S3
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+)
+
+# Lifetime of the report download link, in seconds
+PRESIGNED_URL_EXPIRATION = 24 * 60 * 60
+
+# Shared read-only defaults for missing finding fields
+EMPTY = {}
+NO_RESOURCES = (EMPTY,)
+
+# Security standards recognised in the findingId
+KNOWN_STANDARDS = (
+    "aws-foundational-security-best-practices",
+    "aws-resource-tagging-standard",
+    "cis-aws-foundations-benchmark",
+    "nist-800-53",
+    "pci-dss",
+)
+KNOWN_STANDARDS_PATTERN = re.compile("|".join(map(re.escape, KNOWN_STANDARDS)))
 
 
 ###############################################################################
 ### Functions
 ###############################################################################
+@lru_cache(maxsize=8192)
 def extract_security_standards_from_finding_id(finding_id):
     """
     Extracts security standards from the findingId field.
 
     :param finding_id: The findingId string from which to extract the security standards.
-    :return: A list of security standards found in the findingId.
+    :return: A tuple of security standards found in the findingId.
     """
-    known_standards = [
-        "aws-foundational-security-best-practices",
-        "aws-resource-tagging-standard",
-        "cis-aws-foundations-benchmark",
-        "nist-800-53",
-        "pci-dss",
-    ]
-    extracted_standards = [
-        standard for standard in known_standards if standard in finding_id
-    ]
-    return extracted_standards
+    return tuple(dict.fromkeys(KNOWN_STANDARDS_PATTERN.findall(finding_id)))
 
 
 def filter_data(
@@ -60,88 +136,219 @@ def filter_data(
     Filters the input list based on severity, compliance status, workflow status, and security standard, if provided,
     and flattens the structure by adding a 'workflowStatus' field. Also creates a 'securityStandards' field by examining the findingId.
 
-    :param input_list: List of findings to filter.
+    :param input_list: Iterable of findings to filter.
     :param complianceStatus_filter: List of compliance statuses to include in the output. If None, include all.
     :param security_standard_filter: List of security standards to include in the output. If None, include all.
     :param severity_filter: List of severities to include in the output. If None, include all.
     :param workflow_status_filter: List of workflow statuses to include in the output. If None, include all.
-    :return: Filtered and flattened list of findings.
+    :return: Generator of filtered and flattened findings as rows in CSV_HEADERS order.
     """
     logger.info("Filtering findings data")
-    filtered_list = [
-        {
-            "awsAccountId": item.get("AwsAccountId", ""),
-            "awsAccountName": item.get("AwsAccountName", ""),
-            "complianceStatus": item.get("Compliance", {}).get("Status", ""),
-            "controlId": item.get("ProductFields", {}).get("ControlId", ""),
-            "description": item.get("Description", ""),
-            "findingId": item.get("Id", ""),
-            "firstSeen": item.get("FirstObservedAt", ""),
-            "lastSeen": item.get("LastObservedAt", ""),
-            "region": item.get("Region", ""),
-            "remediationText": item.get("Remediation", {})
-            .get("Recommendation", {})
-            .get("Text", ""),
-            "remediationUrl": item.get("Remediation", {})
-            .get("Recommendation", {})
-            .get("Url", ""),
-            "resourceArn": item.get("Resources", [{}])[0].get("Id", ""),
-            "severity": item.get("Severity", {}).get("Label", ""),
-            "title": item.get("Title", ""),
-            "workflowStatus": item.get("Workflow", {}).get("Status", ""),
-            "securityStandards": extract_security_standards_from_finding_id(
-                item.get("Id", "")
-            ),
-        }
-        for item in input_list
+
+    # Convert the filters to sets once for O(1) membership tests
+    if compliance_status_filter is not None:
+        compliance_status_filter = frozenset(compliance_status_filter)
+    if security_standard_filter is not None:
+        security_standard_filter = frozenset(security_standard_filter)
+    if severity_filter is not None:
+        severity_filter = frozenset(severity_filter)
+    if workflow_status_filter is not None:
+        workflow_status_filter = frozenset(workflow_status_filter)
+
+    # Run the set lookups first, most selective first, so the standards
+    # extraction only runs for findings that pass them
+    for item in input_list:
+        workflow_status = item.get("Workflow", EMPTY).get("Status", "")
         if (
-            severity_filter is None
-            or item.get("Severity", {}).get("Label", "") in severity_filter
+            workflow_status_filter is not None
+            and workflow_status not in workflow_status_filter
+        ):
+            continue
+
+        compliance_status = item.get("Compliance", EMPTY).get("Status", "")
+        if (
+            compliance_status_filter is not None
+            and compliance_status not in compliance_status_filter
+        ):
+            continue
+
+        severity = item.get("Severity", EMPTY).get("Label", "")
+        if severity_filter is not None and severity not in severity_filter:
+            continue
+
+        # Extract the standards once for both the filter and the output,
+        # looked up by the shared control prefix since the trailing finding
+        # UUID is unique per finding
+        finding_id = item.get("Id", "")
+        security_standards = extract_security_standards_from_finding_id(
+            finding_id.partition("/finding/")[0]
         )
-        and (
-            compliance_status_filter is None
-            or item.get("Compliance", {}).get("Status", "")
-            in compliance_status_filter
+        if (
+            security_standard_filter is not None
+            and security_standard_filter.isdisjoint(security_standards)
+        ):
+            continue
+
+        recommendation = item.get("Remediation", EMPTY).get(
+            "Recommendation", EMPTY
         )
-        and (
-            workflow_status_filter is None
-            or item.get("Workflow", {}).get("Status", "")
-            in workflow_status_filter
+
+        yield (
+            item.get("AwsAccountId", ""),
+            item.get("AwsAccountName", ""),
+            compliance_status,
+            item.get("ProductFields", EMPTY).get("ControlId", ""),
+            item.get("Description", ""),
+            finding_id,
+            item.get("FirstObservedAt", ""),
+            item.get("LastObservedAt", ""),
+            item.get("Region", ""),
+            recommendation.get("Text", ""),
+            recommendation.get("Url", ""),
+            (item.get("Resources") or NO_RESOURCES)[0].get("Id", ""),
+            list(security_standards),
+            severity,
+            item.get("Title", ""),
+            workflow_status,
         )
-        and (
-            security_standard_filter is None
-            or any(
-                standard
-                in extract_security_standards_from_finding_id(
-                    item.get("Id", "")
-                )
-                for standard in security_standard_filter
+
+
+def build_filters(
+    compliance_status_filter=None,
+    security_standard_filter=None,
+    workflow_status_filter=None,
+):
+    """
+    Builds the Security Hub findings filters so filtering happens server-side.
+
+    :param compliance_status_filter: List of compliance statuses to include. If None, include all.
+    :param security_standard_filter: List of security standards to include. If None, include all.
+    :param workflow_status_filter: List of workflow statuses to include. If None, include all.
+    :return: AwsSecurityFindingFilters dictionary for the get_findings API.
+    """
+    filters = {}
+    for field, values in (
+        ("ComplianceStatus", compliance_status_filter),
+        ("WorkflowStatus", workflow_status_filter),
+    ):
+        if values:
+            filters[field] = [
+                {"Value": value, "Comparison": "EQUALS"} for value in values
+            ]
+
+    # Standard control findings have a GeneratorId starting with the
+    # standard, or with its ruleset ARN for CIS v1.2.0
+    if security_standard_filter:
+        filters["GeneratorId"] = [
+            {"Value": value, "Comparison": "PREFIX"}
+            for standard in security_standard_filter
+            for value in (
+                f"{standard}/",
+                f"arn:aws:securityhub:::ruleset/{standard}/",
             )
-        )
+        ]
+    return filters
+
+
+def severity_partitions(severity_filter=None):
+    """
+    Splits the Security Hub query into one filter per severity label.
+
+    :param severity_filter: List of severities to fetch. If None, fetch all.
+    :return: List of Security Hub filters that together cover the findings.
+    """
+    if severity_filter is not None:
+        return [
+            {"SeverityLabel": [{"Value": severity, "Comparison": "EQUALS"}]}
+            for severity in dict.fromkeys(severity_filter)
+        ]
+
+    # Catch findings without one of the known labels in a final query
+    return [
+        {"SeverityLabel": [{"Value": severity, "Comparison": "EQUALS"}]}
+        for severity in SEVERITY_LABELS
+    ] + [
+        {
+            "SeverityLabel": [
+                {"Value": severity, "Comparison": "NOT_EQUALS"}
+                for severity in SEVERITY_LABELS
+            ]
+        }
     ]
-    logger.info(f"Filtered data contains {len(filtered_list)} findings")
-    return filtered_list
 
 
-def get_findings():
+def get_findings(filters=None, severity_filter=None):
     logger.info("Getting findings from AWS Security Hub")
-    findings = []
+
+    # Add the severity of each partition to the shared filters
+    partitions = [
+        {**(filters or {}), **partition}
+        for partition in severity_partitions(severity_filter)
+    ]
+
+    # Pages from all partitions, with a None marking a finished partition.
+    # At most one page per worker is buffered ahead of the CSV writer.
+    workers = len(partitions) or 1
+    pages = Queue(maxsize=workers)
+
+    # Set once the consumer is done, early or not, to release the workers
+    stop = Event()
+
+    def put_page(findings):
+        while not stop.is_set():
+            try:
+                pages.put(findings, timeout=QUEUE_PUT_TIMEOUT)
+                return True
+            except Full:
+                continue
+        return False
+
+    def fetch_partition(partition_filters):
+        try:
+            paginator = sh.get_paginator("get_findings")
+            for page in paginator.paginate(
+                Filters=partition_filters,
+                PaginationConfig={"PageSize": PAGE_SIZE},
+            ):
+                if not put_page(page["Findings"]):
+                    return
+        finally:
+            put_page(None)
+
     try:
-        paginator = sh.get_paginator("get_findings")
-        for page in paginator.paginate():
-            findings.extend(page["Findings"])
-        logger.info(f"Found {len(findings)} findings")
-        return findings
+        # Page through each partition in parallel and yield the findings in
+        # the order the pages arrive
+        with ThreadPoolExecutor(workers) as executor:
+            futures = [
+                executor.submit(fetch_partition, partition_filters)
+                for partition_filters in partitions
+            ]
+
+            try:
+                remaining = len(futures)
+                while remaining:
+                    findings = pages.get()
+                    if findings is None:
+                        remaining -= 1
+                    else:
+                        yield from findings
+            finally:
+                # Stop the workers when the consumer closes or raises
+                stop.set()
+
+            # Raise the first error hit by any of the partitions
+            for future in futures:
+                future.result()
     except Exception as e:
-        logger.error(f"Error getting findings: {e}")
+        logger.error("Error getting findings: %s", e)
+        raise
 
 
-def send_email_with_attachment(
-    csv_content,
+def send_email(
     event,
+    csv_content=None,
+    presigned_url=None,
 ):
-    logger.info("Sending email with attachment")
-
     # Get the current date
     current_date = datetime.now()
 
@@ -155,72 +362,81 @@ def send_email_with_attachment(
     # Create the email subject
     subject = event.get("subject", "AWS Security Hub Findings")
 
-    # Create the email body
-    default_text = "Please find the attached CSV file containing the filtered AWS Security Hub findings."
-    body_text = event.get("body", default_text)
-
     # Create a new SES resource and specify a region.
     charset = event.get("charset", "utf-8")
 
-    # Attachment Filename
-    filename = event.get("filename", f"securityhub-findings-{date_str}.csv")
+    # Build the MIME message
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["To"] = ", ".join(recipient_emails)
+    msg["Subject"] = subject
+
+    if presigned_url:
+        logger.info("Sending email with presigned URL")
+
+        # Create the email body with the download link
+        default_text = "Please download the gzipped CSV file containing the filtered AWS Security Hub findings from the link below. The link expires in 24 hours."
+        body_text = event.get("body", default_text)
+        msg.set_content(f"{body_text}\n\n{presigned_url}\n", charset=charset)
+    else:
+        logger.info("Sending email with attachment")
+
+        # Create the email body
+        default_text = "Please find the attached CSV file containing the filtered AWS Security Hub findings."
+        body_text = event.get("body", default_text)
+        msg.set_content(body_text, charset=charset)
+
+        # Attach the gzipped CSV as base64
+        filename = event.get(
+            "filename", f"securityhub-findings-{date_str}.csv.gz"
+        )
+        msg.add_attachment(
+            csv_content,
+            maintype="application",
+            subtype="gzip",
+            filename=filename,
+        )
 
     # Try to send the email
     try:
         response = ses.send_raw_email(
             Source=sender,
             Destinations=recipient_emails,
-            RawMessage={
-                "Data": (
-                    f"From: {sender}\n"
-                    f"To: {', '.join(recipient_emails)}\n"
-                    f"Subject: {subject}\n"
-                    "MIME-Version: 1.0\n"
-                    'Content-Type: multipart/mixed; boundary="NextPart"\n\n'
-                    "--NextPart\n"
-                    f"Content-Type: text/plain; charset={charset}\n\n"
-                    f"{body_text}\n\n"
-                    "--NextPart\n"
-                    "Content-Type: text/csv;\n"
-                    f'Content-Disposition: attachment; filename="{filename}"\n\n'
-                    f"{csv_content}\n\n"
-                    "--NextPart--"
-                )
-            },
+            RawMessage={"Data": msg.as_bytes()},
         )
     except ClientError as e:
-        logger.error(f"Error sending email: {e.response['Error']['Message']}")
+        logger.error("Error sending email: %s", e.response["Error"]["Message"])
     else:
-        logger.info("Email sent! Message ID:"),
-        logger.info(response["MessageId"])
-
-
-def write_to_csv(filtered_data):
-    # Create a CSV in memory
-    csv_file = StringIO()
-    fieldnames = [
-        "awsAccountId",
-        "awsAccountName",
-        "complianceStatus",
-        "controlId",
-        "description",
-        "findingId",
-        "firstSeen",
-        "lastSeen",
-        "region",
-        "remediationText",
-        "remediationUrl",
-        "resourceArn",
-        "securityStandards",
-        "severity",
-        "title",
-        "workflowStatus",
-    ]
-    writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-    writer.writeheader()
-    for data in filtered_data:
-        writer.writerow(data)
-    return csv_file.getvalue()
+        logger.info("Email sent! Message ID: %s", response["MessageId"])
+
+
+def upload_to_s3(csv_file, bucket_name, key):
+    """Upload the report to S3 and return a presigned URL to download it."""
+    logger.info("Uploading report to S3: s3://%s/%s", bucket_name, key)
+
+    # Large reports are sent as a multipart upload
+    s3.upload_fileobj(
+        csv_file,
+        bucket_name,
+        key,
+        ExtraArgs={"ContentType": "application/gzip"},
+        Config=TRANSFER_CONFIG,
+    )
+
+    return s3.generate_presigned_url(
+        ClientMethod="get_object",
+        Params={"Bucket": bucket_name, "Key": key},
+        ExpiresIn=PRESIGNED_URL_EXPIRATION,
+    )
+
+
+def write_to_csv(filtered_data, csv_file):
+    # Write a gzipped CSV to the file, compressing the rows as they are written
+    with gzip.GzipFile(fileobj=csv_file, mode="wb", compresslevel=6) as gz:
+        with TextIOWrapper(gz, encoding="utf-8", newline="") as text:
+            writer = csv.writer(text)
+            writer.writerow(CSV_HEADERS)
+            writer.writerows(filtered_data)
 
 
 ###############################################################################
@@ -228,11 +444,8 @@ def write_to_csv(filtered_data):
 ###############################################################################
 def lambda_handler(event, context):
     # Log Event and Context
-    logger.info(f"event: {event}")
-    logger.info(f"context: {context.__dict__}")
-
-    # Get Security Hub findings
-    input_data = get_findings()
+    logger.debug("event: %s", event)
+    logger.debug("context: %s", context.__dict__)
 
     # Extract filter criteria from the event data
     compliance_status_filter = event.get("compliance_status_filter", None)
@@ -240,6 +453,17 @@ def lambda_handler(event, context):
     severity_filter = event.get("severity_filter", None)
     workflow_status_filter = event.get("workflow_status_filter", None)
 
+    # Prepare Server-Side Filters
+    filters = build_filters(
+        compliance_status_filter,
+        security_standard_filter,
+        workflow_status_filter,
+    )
+    logger.debug("Fetching findings with filters: %s", filters)
+
+    # Get Security Hub findings, querying only the requested severities
+    input_data = get_findings(filters, severity_filter)
+
     # Filter the data
     filtered_data = filter_data(
         input_data,
@@ -249,15 +473,30 @@ def lambda_handler(event, context):
         workflow_status_filter,
     )
 
-    # Convert filtered data to CSV
-    csv_content = write_to_csv(filtered_data)
-
-    # Email CSV as an attachment
     recipient_emails = event.get("to_emails")
-    send_email_with_attachment(
-        csv_content,
-        event,
-    )
+    bucket_name = event.get("bucket_name", None)
+
+    if bucket_name:
+        # Spool the CSV to S3 and email a download link
+        with SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as csv_file:
+            write_to_csv(filtered_data, csv_file)
+            csv_file.seek(0)
+
+            # Save the report under a dated key unless one is given
+            date_str = datetime.now().strftime("%m%d%Y")
+            key = event.get(
+                "key", f"reports/securityhub-findings-{date_str}.csv.gz"
+            )
+            presigned_url = upload_to_s3(csv_file, bucket_name, key)
+
+        send_email(event, presigned_url=presigned_url)
+    else:
+        # Convert filtered data to CSV
+        csv_file = BytesIO()
+        write_to_csv(filtered_data, csv_file)
+
+        # Email CSV as an attachment, encoding it from the buffer in place
+        send_email(event, csv_content=csv_file.getbuffer())
 
     return {
         "statusCode": 200,
@@ -0,0 +1,18 @@
+###############################################################################
+### Imports
+###############################################################################
+from functools import lru_cache
+from constructs import Construct
+
+
+###############################################################################
+### Functions
+###############################################################################
+@lru_cache(maxsize=None)
+def _root_context(root: Construct, key: str):
+    return root.node.try_get_context(key)
+
+
+def get_context(scope: Construct, key: str):
+    """Look up an app context value once per app and reuse it."""
+    return _root_context(scope.node.root, key)
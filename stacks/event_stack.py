@@ -1,41 +1,48 @@
 ###############################################################################
 ### CDK Imports
 ###############################################################################
-from aws_cdk import Duration, NestedStack
+from aws_cdk import Duration
 from aws_cdk.aws_events import Rule, RuleTargetInput, Schedule
-from aws_cdk.aws_events_targets import LambdaFunction, SfnStateMachine
+from aws_cdk.aws_events_targets import SfnStateMachine
 from constructs import Construct
+from stacks.context import get_context
+
+###############################################################################
+### Constants
+###############################################################################
+# Duration factory per schedule rate unit, hourly when the unit is unknown
+SCHEDULE_RATE_OPTIONS = {
+    "minutes": Duration.minutes,
+    "hours": Duration.hours,
+    "days": Duration.days,
+}
+DEFAULT_SCHEDULE_RATE = Duration.hours(1)
 
 
 ###############################################################################
 ### Functions
 ###############################################################################
 def schedule_config(rate, duration):
-    schedule_options = {
-        "minutes": Duration.minutes(duration),
-        "hours": Duration.hours(duration),
-        "days": Duration.days(duration),
-    }
-    return schedule_options.get(rate, Duration.hours(1))
+    if rate not in SCHEDULE_RATE_OPTIONS:
+        return DEFAULT_SCHEDULE_RATE
+    return SCHEDULE_RATE_OPTIONS[rate](duration)
 
 
 ###############################################################################
 ### Stack Definition
 ###############################################################################
-class EventStack(NestedStack):
+class EventStack(Construct):
     def __init__(
         self,
         scope: Construct,
         construct_id: str,
         step_stack=None,
         storage_stack=None,
-        **kwargs,
     ) -> None:
-        super().__init__(scope, construct_id, **kwargs)
+        super().__init__(scope, construct_id)
 
         # Global Variables
-        constants_vars = self.node.try_get_context("constants")
-        events_vars = self.node.try_get_context("events")
+        events_vars = get_context(self, "events")
 
         for rule in events_vars.get("rules", []):
             Rule(
@@ -1,7 +1,8 @@
 ###############################################################################
 ### CDK Imports
 ###############################################################################
-from aws_cdk import Duration, NestedStack
+from functools import lru_cache
+from aws_cdk import Duration
 from aws_cdk.aws_iam import (
     Effect,
     ManagedPolicy,
@@ -10,31 +11,37 @@ from aws_cdk.aws_iam import (
     ServicePrincipal,
 )
 from constructs import Construct
+from stacks.context import get_context
+
+
+###############################################################################
+### Constants
+###############################################################################
+# Maximum session duration of the Lambda execution roles
+MAX_SESSION_DURATION = Duration.hours(1)
+
+
+###############################################################################
+### Functions
+###############################################################################
+@lru_cache(maxsize=None)
+def aws_managed_policy(name):
+    """Reference an AWS managed policy, one shared reference per name."""
+    return ManagedPolicy.from_aws_managed_policy_name(name)
 
 
 ###############################################################################
 ### Stack Definition
 ###############################################################################
-class IamStack(NestedStack):
+class IamStack(Construct):
     def __init__(
-        self, scope: Construct, construct_id: str, storage_stack=None, **kwargs
+        self, scope: Construct, construct_id: str, storage_stack=None
     ) -> None:
-        super().__init__(scope, construct_id, **kwargs)
+        super().__init__(scope, construct_id)
 
         # Global Variables
-        constants_vars = self.node.try_get_context("constants")
-        iam_vars = self.node.try_get_context("iam")
-
-        # Managed Policies
-        managed_policies = {
-            "lambda_basic_execution": "service-role/AWSLambdaBasicExecutionRole",
-        }
-
-        # Service Principals
-        service_principals = {
-            "lambda": "lambda.amazonaws.com",
-            "states": "states.amazonaws.com",
-        }
+        constants_vars = get_context(self, "constants")
+        iam_vars = get_context(self, "iam")
 
         # Lambda
         # Fetch Findings Policy
@@ -63,6 +70,7 @@ class IamStack(NestedStack):
                 PolicyStatement(
                     effect=Effect.ALLOW,
                     actions=[
+                        "s3:AbortMultipartUpload",
                         "s3:PutObject",
                     ],
                     resources=["*"],
@@ -127,19 +135,19 @@ class IamStack(NestedStack):
         self.lambda_fetch_findings_role = Role(
             self,
             "FetchFindingsRole",
-            assumed_by=ServicePrincipal(service_principals.get("lambda", None)),
+            assumed_by=ServicePrincipal("lambda.amazonaws.com"),
             description=constants_vars.get(
                 "fetch_findings_description",
                 "Lambda Security Hub Fetch Findings",
             )
             + " Role",
             managed_policies=[
-                ManagedPolicy.from_aws_managed_policy_name(
-                    managed_policies.get("lambda_basic_execution", None)
+                aws_managed_policy(
+                    "service-role/AWSLambdaBasicExecutionRole"
                 ),
                 self.lambda_fetch_findings_policy,
             ],
-            max_session_duration=Duration.hours(1),
+            max_session_duration=MAX_SESSION_DURATION,
             path=iam_vars.get("path", "/"),
             role_name=constants_vars.get(
                 "fetch_findings_name",
@@ -152,19 +160,19 @@ class IamStack(NestedStack):
         self.lambda_generate_csv_role = Role(
             self,
             "GenerateCsvRole",
-            assumed_by=ServicePrincipal(service_principals.get("lambda", None)),
+            assumed_by=ServicePrincipal("lambda.amazonaws.com"),
             description=constants_vars.get(
                 "generate_csv_description",
                 "Lambda Security Hub Generate CSV",
             )
             + " Role",
             managed_policies=[
-                ManagedPolicy.from_aws_managed_policy_name(
-                    managed_policies.get("lambda_basic_execution", None)
+                aws_managed_policy(
+                    "service-role/AWSLambdaBasicExecutionRole"
                 ),
                 self.lambda_generate_csv_policy,
             ],
-            max_session_duration=Duration.hours(1),
+            max_session_duration=MAX_SESSION_DURATION,
             path=iam_vars.get("path", "/"),
             role_name=constants_vars.get(
                 "generate_csv_name",
@@ -177,19 +185,19 @@ class IamStack(NestedStack):
         self.lambda_send_email_role = Role(
             self,
             "SendEmailRole",
-            assumed_by=ServicePrincipal(service_principals.get("lambda", None)),
+            assumed_by=ServicePrincipal("lambda.amazonaws.com"),
             description=constants_vars.get(
                 "send_email_description",
                 "Lambda Security Hub Send Email Role",
             )
             + " Role",
             managed_policies=[
-                ManagedPolicy.from_aws_managed_policy_name(
-                    managed_policies.get("lambda_basic_execution", None)
+                aws_managed_policy(
+                    "service-role/AWSLambdaBasicExecutionRole"
                 ),
                 self.lambda_send_email_policy,
             ],
-            max_session_duration=Duration.hours(1),
+            max_session_duration=MAX_SESSION_DURATION,
             path=iam_vars.get("path", "/"),
             role_name=constants_vars.get(
                 "send_email_name",
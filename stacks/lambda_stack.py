@@ -1,8 +1,7 @@
 ###############################################################################
 ### CDK Imports
 ###############################################################################
-import os
-from aws_cdk import Duration, NestedStack
+from aws_cdk import Duration
 from aws_cdk.aws_lambda import (
     ApplicationLogLevel,
     Architecture,
@@ -14,210 +13,175 @@ from aws_cdk.aws_lambda import (
     Tracing,
 )
 from constructs import Construct
+from stacks.context import get_context
+
+###############################################################################
+### Constants
+###############################################################################
+# Lambda Lookup Options
+APP_LOG_LEVEL_OPTIONS = {
+    "debug": ApplicationLogLevel.DEBUG,
+    "error": ApplicationLogLevel.ERROR,
+    "fatal": ApplicationLogLevel.FATAL,
+    "info": ApplicationLogLevel.INFO,
+    "trace": ApplicationLogLevel.TRACE,
+    "warn": ApplicationLogLevel.WARN,
+}
+
+ARCH_OPTIONS = {
+    "arm64": Architecture.ARM_64,
+    "x86_64": Architecture.X86_64,
+}
+
+LOG_FORMAT_OPTIONS = {
+    "json": LoggingFormat.JSON,
+    "text": LoggingFormat.TEXT,
+}
+
+RUNTIME_OPTIONS = {
+    "python3.12": Runtime.PYTHON_3_12,
+}
+
+SYSTEM_LOG_LEVEL_OPTIONS = {
+    "debug": SystemLogLevel.DEBUG,
+    "info": SystemLogLevel.INFO,
+    "warn": SystemLogLevel.WARN,
+}
+
+TRACING_OPTIONS = {
+    "active": Tracing.ACTIVE,
+    "disabled": Tracing.DISABLED,
+    "passthrough": Tracing.PASS_THROUGH,
+}
+
+
+###############################################################################
+### Functions
+###############################################################################
+def resolve_option(options, settings, key, default):
+    """Resolve a context setting to its CDK option, or the default."""
+    value = settings.get(key)
+    return options[value] if value in options else default
 
 
 ###############################################################################
 ### Stack Definition
 ###############################################################################
-class LambdaStack(NestedStack):
+class LambdaStack(Construct):
     def __init__(
         self,
         scope: Construct,
         construct_id: str,
         iam_stack=None,
-        **kwargs,
     ) -> None:
-        super().__init__(scope, construct_id, **kwargs)
+        super().__init__(scope, construct_id)
 
         # Global Variables
-        constants_vars = self.node.try_get_context("constants")
-        lambda_vars = self.node.try_get_context("lambda")
+        constants_vars = get_context(self, "constants")
+        lambda_vars = get_context(self, "lambda")
 
         # Environment Variables
         environment_variables = {}
 
-        # Lambda Lookup Options
-        app_log_level_options = {
-            "debug": ApplicationLogLevel.DEBUG,
-            "error": ApplicationLogLevel.ERROR,
-            "fatal": ApplicationLogLevel.FATAL,
-            "info": ApplicationLogLevel.INFO,
-            "trace": ApplicationLogLevel.TRACE,
-            "warn": ApplicationLogLevel.WARN,
-        }
-
-        arch_options = {
-            "arm64": Architecture.ARM_64,
-            "x86_64": Architecture.X86_64,
-        }
-
-        log_format_options = {
-            "json": LoggingFormat.JSON,
-            "text": LoggingFormat.TEXT,
-        }
-
-        runtime_type = {
-            "python3.12": Runtime.PYTHON_3_12,
-        }
-
-        system_log_level_options = {
-            "debug": SystemLogLevel.DEBUG,
-            "info": SystemLogLevel.INFO,
-            "warn": SystemLogLevel.WARN,
-        }
-
-        tracing_options = {
-            "active": Tracing.ACTIVE,
-            "disabled": Tracing.DISABLED,
-            "passthrough": Tracing.PASS_THROUGH,
-        }
-
-        # Fetch Findings Function
-        self.fetch_findings_function = Function(
-            self,
-            "FetchFindings",
-            application_log_level_v2=app_log_level_options.get(
-                lambda_vars.get("loglevel_app", None),
-                SystemLogLevel.INFO,
-            ),
-            architecture=arch_options.get(
-                lambda_vars.get("arch", None),
-                Architecture.X86_64,
-            ),
-            code=Code.from_asset(os.path.join("lambdas", "fetchfindings")),
-            description=constants_vars.get(
-                "fetch_findings_name",
-                "Security Hub Fetch Findings",
-            )
-            + " Function",
-            environment={
+        # Options shared by every function
+        common_options = {
+            "application_log_level_v2": resolve_option(
+                APP_LOG_LEVEL_OPTIONS,
+                lambda_vars,
+                "loglevel_app",
+                ApplicationLogLevel.INFO,
+            ),
+            "architecture": resolve_option(
+                ARCH_OPTIONS, lambda_vars, "arch", Architecture.X86_64
+            ),
+            "environment": {
                 **environment_variables,
                 **lambda_vars.get("env_vars", {}),
             },
-            function_name=constants_vars.get(
-                "fetch_findings_name",
-                "securityhub-fetch-findings",
-            )
-            + "-function",
-            handler=lambda_vars.get("handler", "index.lambda_handler"),
-            logging_format=log_format_options.get(
-                lambda_vars.get("logformat", None),
+            "handler": lambda_vars.get("handler", "index.lambda_handler"),
+            "logging_format": resolve_option(
+                LOG_FORMAT_OPTIONS,
+                lambda_vars,
+                "logformat",
                 LoggingFormat.JSON,
             ),
-            max_event_age=Duration.hours(lambda_vars.get("max_event_age", 6)),
-            memory_size=lambda_vars.get("get_function_memory_size", 128),
-            role=iam_stack.lambda_fetch_findings_role,
-            runtime=runtime_type.get(
-                lambda_vars.get("runtime_type", None),
+            "max_event_age": Duration.hours(
+                lambda_vars.get("max_event_age", 6)
+            ),
+            "runtime": resolve_option(
+                RUNTIME_OPTIONS,
+                lambda_vars,
+                "runtime_type",
                 Runtime.PYTHON_3_12,
             ),
-            system_log_level_v2=system_log_level_options.get(
-                lambda_vars.get("loglevel_sys", None),
+            "system_log_level_v2": resolve_option(
+                SYSTEM_LOG_LEVEL_OPTIONS,
+                lambda_vars,
+                "loglevel_sys",
                 SystemLogLevel.INFO,
             ),
-            timeout=Duration.seconds(lambda_vars.get("timeout", 3)),
-            tracing=tracing_options.get(
-                lambda_vars.get("tracing_type", None),
-                Tracing.DISABLED,
+            "timeout": Duration.seconds(lambda_vars.get("timeout", 3)),
+            "tracing": resolve_option(
+                TRACING_OPTIONS, lambda_vars, "tracing_type", Tracing.DISABLED
             ),
-        )
+        }
 
-        # Generate CSV Function
-        self.generate_csv_function = Function(
-            self,
-            "GenerateCsv",
-            application_log_level_v2=app_log_level_options.get(
-                lambda_vars.get("loglevel_app", None),
-                SystemLogLevel.INFO,
-            ),
-            architecture=arch_options.get(
-                lambda_vars.get("arch", None),
-                Architecture.X86_64,
+        # Per function settings: construct id, asset path, name key,
+        # default description, default name, memory size key and role
+        function_specs = (
+            (
+                "FetchFindings",
+                "lambdas/fetchfindings",
+                "fetch_findings_name",
+                "Security Hub Fetch Findings",
+                "securityhub-fetch-findings",
+                "get_function_memory_size",
+                iam_stack.lambda_fetch_findings_role,
             ),
-            code=Code.from_asset(os.path.join("lambdas", "generatecsv")),
-            description=constants_vars.get(
+            (
+                "GenerateCsv",
+                "lambdas/generatecsv",
                 "generate_csv_name",
                 "Security Hub Generate CSV",
-            )
-            + " Function",
-            environment={
-                **environment_variables,
-                **lambda_vars.get("env_vars", {}),
-            },
-            function_name=constants_vars.get(
-                "generate_csv_name",
                 "securityhub-generate-csv",
-            )
-            + "-function",
-            handler=lambda_vars.get("handler", "index.lambda_handler"),
-            logging_format=log_format_options.get(
-                lambda_vars.get("logformat", None),
-                LoggingFormat.JSON,
-            ),
-            max_event_age=Duration.hours(lambda_vars.get("max_event_age", 6)),
-            memory_size=lambda_vars.get("csv_function_memory_size", 128),
-            role=iam_stack.lambda_generate_csv_role,
-            runtime=runtime_type.get(
-                lambda_vars.get("runtime_type", None),
-                Runtime.PYTHON_3_12,
-            ),
-            system_log_level_v2=system_log_level_options.get(
-                lambda_vars.get("loglevel_sys", None),
-                SystemLogLevel.INFO,
-            ),
-            timeout=Duration.seconds(lambda_vars.get("timeout", 3)),
-            tracing=tracing_options.get(
-                lambda_vars.get("tracing_type", None),
-                Tracing.DISABLED,
-            ),
-        )
-
-        # Send Email Function
-        self.send_email_function = Function(
-            self,
-            "SendEmail",
-            application_log_level_v2=app_log_level_options.get(
-                lambda_vars.get("loglevel_app", None),
-                SystemLogLevel.INFO,
-            ),
-            architecture=arch_options.get(
-                lambda_vars.get("arch", None),
-                Architecture.X86_64,
+                "csv_function_memory_size",
+                iam_stack.lambda_generate_csv_role,
             ),
-            code=Code.from_asset(os.path.join("lambdas", "sendemail")),
-            description=constants_vars.get(
+            (
+                "SendEmail",
+                "lambdas/sendemail",
                 "send_email_name",
                 "Security Hub Send Email",
-            )
-            + " Function",
-            environment={
-                **environment_variables,
-                **lambda_vars.get("env_vars", {}),
-            },
-            function_name=constants_vars.get(
-                "send_email_name",
                 "securityhub-send-email",
-            )
-            + "-function",
-            handler=lambda_vars.get("handler", "index.lambda_handler"),
-            logging_format=log_format_options.get(
-                lambda_vars.get("logformat", None),
-                LoggingFormat.JSON,
-            ),
-            max_event_age=Duration.hours(lambda_vars.get("max_event_age", 6)),
-            memory_size=lambda_vars.get("email_function_memory_size", 128),
-            role=iam_stack.lambda_send_email_role,
-            runtime=runtime_type.get(
-                lambda_vars.get("runtime_type", None),
-                Runtime.PYTHON_3_12,
-            ),
-            system_log_level_v2=system_log_level_options.get(
-                lambda_vars.get("loglevel_sys", None),
-                SystemLogLevel.INFO,
-            ),
-            timeout=Duration.seconds(lambda_vars.get("timeout", 3)),
-            tracing=tracing_options.get(
-                lambda_vars.get("tracing_type", None),
-                Tracing.DISABLED,
+                "email_function_memory_size",
+                iam_stack.lambda_send_email_role,
             ),
         )
+
+        # Fetch Findings, Generate CSV and Send Email Functions
+        (
+            self.fetch_findings_function,
+            self.generate_csv_function,
+            self.send_email_function,
+        ) = (
+            Function(
+                self,
+                function_id,
+                code=Code.from_asset(asset),
+                description=constants_vars.get(name_key, description)
+                + " Function",
+                function_name=constants_vars.get(name_key, name) + "-function",
+                memory_size=lambda_vars.get(memory_key, 128),
+                role=role,
+                **common_options,
+            )
+            for (
+                function_id,
+                asset,
+                name_key,
+                description,
+                name,
+                memory_key,
+                role,
+            ) in function_specs
+        )
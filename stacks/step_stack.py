@@ -1,8 +1,8 @@
 ###############################################################################
 ### CDK Imports
 ###############################################################################
-from aws_cdk import Duration, NestedStack
-from aws_cdk.aws_logs import LogGroup
+from aws_cdk import Duration, RemovalPolicy
+from aws_cdk.aws_logs import LogGroup, RetentionDays
 from aws_cdk.aws_stepfunctions import (
     Choice,
     Condition,
@@ -15,6 +15,8 @@ from aws_cdk.aws_stepfunctions import (
 )
 from aws_cdk.aws_stepfunctions_tasks import LambdaInvoke
 from constructs import Construct
+from stacks.context import get_context
+from stacks.iam_stack import aws_managed_policy
 from aws_cdk.aws_iam import (
     Effect,
     ManagedPolicy,
@@ -23,11 +25,35 @@ from aws_cdk.aws_iam import (
     ServicePrincipal,
 )
 
+###############################################################################
+### Constants
+###############################################################################
+# Defaults for the parameters missing from the execution input, the
+# filters are left out as the Lambdas treat a missing filter as None
+DEFAULT_PARAMETERS = {
+    "BodyText": "Please find the attached CSV file containing the filtered AWS Security Hub findings.",
+    "Subject": "AWS Security Hub Findings",
+}
+
+# CloudWatch Logs actions the state machine needs for its execution logs,
+# the wildcard covers the Create/Get/Update/Delete/ListLogDeliver(y|ies) set
+STEP_FUNCTION_LOG_ACTIONS = (
+    "logs:*LogDeliver*",
+    "logs:CreateLogStream",
+    "logs:PutLogEvents",
+    "logs:PutResourcePolicy",
+    "logs:DescribeResourcePolicies",
+    "logs:DescribeLogGroups",
+)
+
+# Upper bound on a single workflow execution
+STATE_MACHINE_TIMEOUT = Duration.hours(15)
+
 
 ###############################################################################
 ### Stack Definition
 ###############################################################################
-class StepStack(NestedStack):
+class StepStack(Construct):
     def __init__(
         self,
         scope: Construct,
@@ -35,14 +61,12 @@ class StepStack(NestedStack):
         iam_stack=None,
         lambda_stack=None,
         # storage_stack=None,
-        **kwargs,
     ) -> None:
-        super().__init__(scope, construct_id, **kwargs)
+        super().__init__(scope, construct_id)
 
         # Global Variables
-        constants_vars = self.node.try_get_context("constants")
-        iam_vars = self.node.try_get_context("iam")
-        storage_vars = self.node.try_get_context("storage")
+        constants_vars = get_context(self, "constants")
+        iam_vars = get_context(self, "iam")
 
         # Step Function Execution Policy
         self.step_function_policy = ManagedPolicy(
@@ -62,18 +86,7 @@ class StepStack(NestedStack):
             statements=[
                 PolicyStatement(
                     effect=Effect.ALLOW,
-                    actions=[
-                        "logs:CreateLogDelivery",
-                        "logs:CreateLogStream",
-                        "logs:GetLogDelivery",
-                        "logs:UpdateLogDelivery",
-                        "logs:DeleteLogDelivery",
-                        "logs:ListLogDeliveries",
-                        "logs:PutLogEvents",
-                        "logs:PutResourcePolicy",
-                        "logs:DescribeResourcePolicies",
-                        "logs:DescribeLogGroups",
-                    ],
+                    actions=list(STEP_FUNCTION_LOG_ACTIONS),
                     resources=["*"],
                 ),
             ],
@@ -90,9 +103,7 @@ class StepStack(NestedStack):
             )
             + " Role",
             managed_policies=[
-                ManagedPolicy.from_aws_managed_policy_name(
-                    "service-role/AWSLambdaRole"
-                ),
+                aws_managed_policy("service-role/AWSLambdaRole"),
                 self.step_function_policy,
             ],
             role_name=constants_vars.get(
@@ -102,14 +113,19 @@ class StepStack(NestedStack):
             + "-role",
         )
 
-        # Initialize Defaults Pass State
+        # Initialize Defaults Pass State, seeding an empty task output so the
+        # first fetch merges in no NextToken
         initialize_defaults = Pass(
             self,
             "Initialize Defaults",
             parameters={
-                "MergedParameters.$": 'States.JsonMerge(States.StringToJson(\'{"BodyText": "Please find the attached CSV file containing the filtered AWS Security Hub findings.", "ComplianceStatusFilter": null, "SecurityStandardFilter": null, "SeverityFilter": null, "WorkflowStatusFilter": null, "Subject": "AWS Security Hub Findings" }\'), $$.Execution.Input, false)'
+                "Defaults": {
+                    **DEFAULT_PARAMETERS,
+                    "ExecutionStartTime.$": "$$.Execution.StartTime",
+                },
+                "Payload": {},
             },
-            result_path="$.Parameters",
+            result_path="$.TaskOutput",
         )
 
         # Set Missing Parameters Pass State
@@ -117,57 +133,24 @@ class StepStack(NestedStack):
             self,
             "Set Missing Parameters",
             parameters={
-                "BodyText.$": "$.Parameters.MergedParameters.BodyText",
-                "ComplianceStatusFilter.$": "$.Parameters.MergedParameters.ComplianceStatusFilter",
-                "SecurityStandardFilter.$": "$.Parameters.MergedParameters.SecurityStandardFilter",
-                "SeverityFilter.$": "$.Parameters.MergedParameters.SeverityFilter",
-                "Subject.$": "$.Parameters.MergedParameters.Subject",
-                "WorkflowStatusFilter.$": "$.Parameters.MergedParameters.WorkflowStatusFilter",
+                "MergedParameters.$": "States.JsonMerge($.TaskOutput.Defaults, $$.Execution.Input, false)",
             },
             result_path="$.Parameters",
         )
 
-        # Fetch Findings without Token Lambda Task
-        fetch_findings_without_token = LambdaInvoke(
-            self,
-            "Fetch Findings without Token",
-            lambda_function=lambda_stack.fetch_findings_function,
-            result_path="$.TaskOutput",
-            payload=TaskInput.from_object(
-                {
-                    "BodyText.$": "$.Parameters.BodyText",
-                    "BucketName.$": "$.BucketName",
-                    "ComplianceStatusFilter.$": "$.Parameters.ComplianceStatusFilter",
-                    "RecipientEmails.$": "$.RecipientEmails",
-                    "SecurityStandardFilter.$": "$.Parameters.SecurityStandardFilter",
-                    "SenderEmail.$": "$.SenderEmail",
-                    "SeverityFilter.$": "$.Parameters.SeverityFilter",
-                    "Subject.$": "$.Parameters.Subject",
-                    "WorkflowStatusFilter.$": "$.Parameters.WorkflowStatusFilter",
-                }
-            ),
+        # The merged execution input plus the last fetch output, the
+        # NextToken while paging and the Prefix once the findings are saved
+        task_payload = TaskInput.from_json_path_at(
+            "States.JsonMerge($.Parameters.MergedParameters, $.TaskOutput.Payload, false)"
         )
 
-        # Fetch Findings with Token Lambda Task
-        fetch_findings_with_token = LambdaInvoke(
+        # Fetch Findings Lambda Task
+        fetch_findings = LambdaInvoke(
             self,
-            "Fetch Findings with Token",
+            "Fetch Findings",
             lambda_function=lambda_stack.fetch_findings_function,
             result_path="$.TaskOutput",
-            payload=TaskInput.from_object(
-                {
-                    "BodyText.$": "$.Parameters.BodyText",
-                    "BucketName.$": "$.BucketName",
-                    "ComplianceStatusFilter.$": "$.Parameters.ComplianceStatusFilter",
-                    "NextToken.$": "$.TaskOutput.Payload.NextToken",
-                    "RecipientEmails.$": "$.RecipientEmails",
-                    "SecurityStandardFilter.$": "$.Parameters.SecurityStandardFilter",
-                    "SenderEmail.$": "$.SenderEmail",
-                    "SeverityFilter.$": "$.Parameters.SeverityFilter",
-                    "Subject.$": "$.Parameters.Subject",
-                    "WorkflowStatusFilter.$": "$.Parameters.WorkflowStatusFilter",
-                }
-            ),
+            payload=task_payload,
         )
 
         # Generate CSV Lambda Task
@@ -176,12 +159,7 @@ class StepStack(NestedStack):
             "Generate CSV",
             lambda_function=lambda_stack.generate_csv_function,
             result_path="$.OutputCsv",
-            payload=TaskInput.from_object(
-                {
-                    "BucketName.$": "$.BucketName",
-                    "Prefix.$": "$.TaskOutput.Payload.Prefix",
-                }
-            ),
+            payload=task_payload,
         )
 
         # Send Email Lambda Task
@@ -191,12 +169,13 @@ class StepStack(NestedStack):
             lambda_function=lambda_stack.send_email_function,
             payload=TaskInput.from_object(
                 {
-                    "BodyText.$": "$.Parameters.BodyText",
+                    "BodyText.$": "$.Parameters.MergedParameters.BodyText",
                     "BucketName.$": "$.BucketName",
+                    "ExecutionStartTime.$": "$.Parameters.MergedParameters.ExecutionStartTime",
                     "OutputCsv.$": "$.OutputCsv.Payload",
                     "RecipientEmails.$": "$.RecipientEmails",
                     "SenderEmail.$": "$.SenderEmail",
-                    "Subject.$": "$.Parameters.Subject",
+                    "Subject.$": "$.Parameters.MergedParameters.Subject",
                 }
             ),
         )
@@ -207,17 +186,22 @@ class StepStack(NestedStack):
         # Define the workflow
         workflow_definition = (
             initialize_defaults.next(set_missing_parameters)
-            .next(fetch_findings_without_token)
+            .next(fetch_findings)
             .next(check_for_next_token)
         )
 
         check_for_next_token.when(
             Condition.is_present("$.TaskOutput.Payload.NextToken"),
-            fetch_findings_with_token.next(check_for_next_token),
+            fetch_findings,
         ).otherwise(generate_csv.next(send_email))
 
         # State Machine Log Group
-        log_group = LogGroup(self, "SecurityHubStateMachineLogGroup")
+        log_group = LogGroup(
+            self,
+            "SecurityHubStateMachineLogGroup",
+            removal_policy=RemovalPolicy.DESTROY,
+            retention=RetentionDays.ONE_WEEK,
+        )
 
         # State Machine
         self.state_machine = StateMachine(
@@ -232,5 +216,5 @@ class StepStack(NestedStack):
             ),
             role=self.step_function_role,
             state_machine_type=StateMachineType.STANDARD,
-            timeout=Duration.hours(15),
+            timeout=STATE_MACHINE_TIMEOUT,
         )
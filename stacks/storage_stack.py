@@ -1,14 +1,13 @@
 ###############################################################################
 ### CDK Imports
 ###############################################################################
-from aws_cdk import NestedStack, RemovalPolicy
+from aws_cdk import RemovalPolicy
 from aws_cdk.aws_s3 import (
     BlockPublicAccess,
     Bucket,
     BucketAccessControl,
     BucketEncryption,
     ObjectOwnership,
-    TargetObjectKeyFormat,
 )
 from constructs import Construct
 
@@ -16,19 +15,14 @@ from constructs import Construct
 ###############################################################################
 ### Stack Definition
 ###############################################################################
-class StorageStack(NestedStack):
+class StorageStack(Construct):
     def __init__(
         self,
         scope: Construct,
         construct_id: str,
         iam_stack=None,
-        **kwargs,
     ) -> None:
-        super().__init__(scope, construct_id, **kwargs)
-
-        # Global Variables
-        constants_vars = self.node.try_get_context("constants")
-        storage_vars = self.node.try_get_context("storage")
+        super().__init__(scope, construct_id)
 
         self.findings_bucket = Bucket(
             self,
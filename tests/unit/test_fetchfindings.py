@@ -0,0 +1,124 @@
+import importlib.util
+import os
+from pathlib import Path
+
+from botocore.stub import Stubber
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+
+INDEX = Path(__file__).parents[2] / "lambdas" / "fetchfindings" / "index.py"
+spec = importlib.util.spec_from_file_location("fetchfindings_index", INDEX)
+fetchfindings = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(fetchfindings)
+
+
+class FakeContext:
+    aws_request_id = "request-1"
+
+    def __init__(self, remaining_ms=900000):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+def finding(index):
+    return {
+        "SchemaVersion": "2018-10-08",
+        "Id": f"arn:aws:securityhub:us-east-1:111111111111:subscription/aws-foundational-security-best-practices/v/1.0.0/S3.1/finding/{index}",
+        "ProductArn": "arn:aws:securityhub:us-east-1::product/aws/securityhub",
+        "GeneratorId": "aws-foundational-security-best-practices/v/1.0.0/S3.1",
+        "AwsAccountId": "111111111111",
+        "Types": ["Software and Configuration Checks"],
+        "CreatedAt": "2024-01-01T00:00:00Z",
+        "UpdatedAt": "2024-01-01T00:00:00Z",
+        "Severity": {"Label": "HIGH"},
+        "Title": f"Finding {index}",
+        "Description": "Description",
+        "Resources": [{"Type": "AwsS3Bucket", "Id": "arn:aws:s3:::bucket"}],
+        "Compliance": {"Status": "FAILED"},
+        "Workflow": {"Status": "NEW"},
+    }
+
+
+def test_get_sh_findings_resumes_from_service_token():
+    # A raw NextToken as returned by the GetFindings API, not a botocore
+    # paginator resume token
+    service_token = "AAMA-EFRSDFAS3ASDFK5ASDF/ASDF+ASDF=="
+
+    with Stubber(fetchfindings.securityhub) as stubber:
+        stubber.add_response(
+            "get_findings",
+            {"Findings": [finding(1)], "NextToken": "next-service-token"},
+            {"Filters": {}, "MaxResults": 100, "NextToken": service_token},
+        )
+        stubber.add_response(
+            "get_findings",
+            {"Findings": [finding(2)]},
+            {
+                "Filters": {},
+                "MaxResults": 100,
+                "NextToken": "next-service-token",
+            },
+        )
+
+        pagination = {"NextToken": service_token}
+        findings = list(
+            fetchfindings.get_sh_findings({}, 100, pagination, FakeContext())
+        )
+
+        stubber.assert_no_pending_responses()
+
+    assert [item["Title"] for item in findings] == ["Finding 1", "Finding 2"]
+    assert pagination["NextToken"] is None
+
+
+def test_get_sh_findings_returns_service_token_when_out_of_time():
+    with Stubber(fetchfindings.securityhub) as stubber:
+        stubber.add_response(
+            "get_findings",
+            {"Findings": [finding(1)], "NextToken": "next-service-token"},
+            {"Filters": {}, "MaxResults": 100},
+        )
+
+        pagination = {"NextToken": None}
+        findings = list(
+            fetchfindings.get_sh_findings(
+                {}, 100, pagination, FakeContext(remaining_ms=1000)
+            )
+        )
+
+        stubber.assert_no_pending_responses()
+
+    assert len(findings) == 1
+    assert pagination["NextToken"] == "next-service-token"
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[Key] = bytes(Body)
+
+
+def test_empty_security_standard_filter_exports_no_rows(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(fetchfindings, "s3", s3)
+
+    event = {
+        "BucketName": "bucket",
+        "ExecutionStartTime": "2024-01-01T00:00:00Z",
+        "SecurityStandardFilter": [],
+    }
+
+    # Security Hub must not be queried at all
+    with Stubber(fetchfindings.securityhub) as stubber:
+        response = fetchfindings.lambda_handler(event, FakeContext())
+        stubber.assert_no_pending_responses()
+
+    assert response == {"Prefix": "findings/2024-01-01"}
+    part = s3.objects["findings/2024-01-01/part-request-1.csv"]
+    assert part.decode().splitlines() == [",".join(fetchfindings.CSV_HEADERS)]